@@ -1,12 +1,184 @@
 """ Converts ARTMIP contributions to a format that conforms to the ARTMIP standard """
 import os
+import concurrent.futures
+import multiprocessing
+import numpy as np
 import xarray as xr
+import cftime
 import collections
+import functools
 import inspect
 import artmip_corrections
 from dask.diagnostics import ProgressBar
 
 
+def calculate_chunk_sizes(
+    xr_var,
+    itemsize,
+    target_size = 4*1024**2,
+    min_size = 16*1024,
+    ):
+    """ Calculate netCDF chunk sizes for a variable. 
+
+    Chunks span the full extent of all non-time dimensions, and the number of
+    time steps per chunk is chosen so that each chunk is roughly `target_size`
+    bytes (but no smaller than `min_size` bytes, unless the variable itself is
+    smaller than that).
+
+    input:
+    ------
+
+        xr_var      : the `xarray.DataArray` to chunk
+
+        itemsize    : the size (in bytes) of one element of the variable on disk
+
+        target_size : the target chunk size (in bytes)
+
+        min_size    : the minimum chunk size (in bytes)
+
+    output:
+    -------
+
+        A tuple of chunk sizes, or None if the variable does not have a time
+        dimension and at least one other dimension (these are left contiguous).
+
+    """
+    if "time" not in xr_var.dims or xr_var.ndim < 2:
+        return None
+
+    # get the size of a single time step
+    frame_size = itemsize
+    for dim, size in zip(xr_var.dims, xr_var.shape):
+        if dim != "time":
+            frame_size *= size
+
+    # determine the number of time steps per chunk
+    ntime = max(target_size // frame_size, -(-min_size // frame_size), 1)
+    ntime = min(ntime, xr_var.sizes["time"])
+
+    return tuple(
+        ntime if dim == "time" else size \
+            for dim, size in zip(xr_var.dims, xr_var.shape))
+
+
+def get_yearly_time_indexers(time_values, units, calendar = "standard"):
+    """ Split (undecoded) time values by year. 
+
+    Only the first and last times are decoded; the year of every other time is
+    found by comparing the raw time values with the (encoded) start of each
+    year.
+
+    input:
+    ------
+
+        time_values : the numeric time values
+
+        units       : the CF units of the time values (e.g., "days since
+                      0001-01-01 00:00:00")
+
+        calendar    : the CF calendar of the time values
+
+    output:
+    -------
+
+        A list of (year, indexer) tuples, where `indexer` selects the times in
+        `year` (a slice if the times are sorted).
+
+    """
+    time_values = np.asarray(time_values)
+
+    # get the range of years
+    first_date, last_date = cftime.num2date(
+        [time_values.min(), time_values.max()], units, calendar)
+    years = np.arange(first_date.year, last_date.year + 1)
+
+    # get the encoded time at the start of each year
+    year_starts = cftime.date2num(
+        [ cftime.datetime(year, 1, 1, calendar = calendar) for year in years ],
+        units,
+        calendar)
+
+    # determine which year each time falls in
+    year_inds = np.searchsorted(year_starts, time_values, side = "right") - 1
+
+    if np.all(np.diff(year_inds) >= 0):
+        # the times are sorted, so each year is a contiguous slice
+        edges = np.searchsorted(year_inds, np.arange(len(years) + 1))
+        return [ (year, slice(start, end)) \
+            for year, start, end in zip(years, edges[:-1], edges[1:]) \
+                if end > start ]
+
+    return [ (year, np.nonzero(year_inds == i)[0]) \
+        for i, year in enumerate(years) if np.any(year_inds == i) ]
+
+
+def bitpack_variable(xr_ds, var = "ar_binary_tag", dim = "lon"):
+    """ Pack a binary (0/1) variable into bits along one of its dimensions.
+
+    Every 8 values along `dim` are packed into a single uint8 value with
+    `numpy.packbits()` (big-endian bit order); the packed dimension is named
+    `{dim}_packed`.  The original values can be recovered with
+    `numpy.unpackbits(packed, axis = axis, count = packed_dimension_length)`,
+    where `axis` is the position of `{dim}_packed`.
+
+    input:
+    ------
+
+        xr_ds : the `xarray.Dataset` containing the variable
+
+        var   : the name of the variable to pack
+
+        dim   : the dimension along which to pack
+
+    output:
+    -------
+
+        A copy of `xr_ds` in which `var` is replaced by its packed version.
+
+    """
+    packed_dim = f"{dim}_packed"
+    dim_len = xr_ds.sizes[dim]
+
+    # packbits needs the whole dimension in each chunk
+    packed = xr.apply_ufunc(
+        np.packbits,
+        xr_ds[var].chunk({dim : -1}) != 0,
+        input_core_dims = [[dim]],
+        output_core_dims = [[packed_dim]],
+        dask = "parallelized",
+        output_dtypes = [np.uint8],
+        dask_gufunc_kwargs = dict(
+            output_sizes = { packed_dim : -(-dim_len // 8) }),
+        kwargs = dict(axis = -1),
+    )
+
+    # document the packing so that the variable can be unpacked
+    packed.attrs = dict(xr_ds[var].attrs)
+    packed.attrs["packed_dimension"] = dim
+    packed.attrs["packed_dimension_length"] = np.int32(dim_len)
+    packed.attrs["packing"] = \
+        f"Binary values packed into bits along `{dim}` with numpy.packbits " \
+        "(big-endian bit order); unpack with numpy.unpackbits(..., " \
+        f"axis = <axis of {packed_dim}>, count = packed_dimension_length)."
+
+    return xr_ds.assign({var : packed})
+
+
+def write_netcdf_file(xr_ds, path, encoding_dict):
+    """ Write a dataset to a single netCDF file; returns the path. 
+
+    This is a module-level function so that it can be run in a separate
+    process (see `ARTMIPStandardizer.write_dataset()`).
+    """
+    xr_ds.to_netcdf(
+        path,
+        encoding = encoding_dict,
+        unlimited_dims = "time",
+        )
+
+    return path
+
+
 class ARTMIPStandardizer:
 
     def __init__(
@@ -15,6 +187,10 @@ class ARTMIPStandardizer:
         original_input_files,
         output_file_template,
         compression_level = 4,
+        compression = "zlib",
+        netcdf_chunk_size = 4*1024**2,
+        num_write_processes = 1,
+        bitpack_ar_binary_tag = False,
         auto_load_files = True,
         auto_apply_corrections = True,
         auto_write_files = True,
@@ -29,10 +205,13 @@ class ARTMIPStandardizer:
 
             artmip_input_files     : the ARMTIP files to process; this argument
                                      should be compatible with 
-                                     `xarray.open_mfdataset()`.
+                                     `xarray.open_mfdataset()`: either a glob
+                                     pattern or an (already expanded) list of
+                                     files, which is used in the given order.
             
             original_input_files   : the original dataset on which ARMIP ARDTs 
-                                     were run; this argument should be compatible with `xarray.open_mfdataset()`.
+                                     were run; this argument should be compatible with `xarray.open_mfdataset()`
+                                     (a glob pattern or a list of files).
             
             
             output_file_template   : a string format template for the output 
@@ -41,6 +220,31 @@ class ARTMIPStandardizer:
             
             compression_level      : the compression level for the files
 
+            compression            : the compression filter for the files:
+                                     'zlib' (the default) or another filter
+                                     supported by the netCDF4 library (e.g.,
+                                     'zstd', which is faster, but requires
+                                     readers with the HDF5 zstd plugin)
+
+            netcdf_chunk_size      : the target size (in bytes) of the netCDF 
+                                     chunks for time-varying variables
+
+            num_write_processes    : the number of processes to use for
+                                     writing the yearly output files; if
+                                     greater than 1, each year is written by
+                                     a separate (spawned) process, so that
+                                     compression of different years
+                                     overlaps.  Scripts that set this must
+                                     guard their top-level code with
+                                     `if __name__ == "__main__":`.
+
+            bitpack_ar_binary_tag  : flags whether to pack ar_binary_tag into
+                                     bits along longitude (see
+                                     `bitpack_variable()`); this shrinks the
+                                     output 8x, but it is not part of the
+                                     ARTMIP standard, so readers need to
+                                     unpack the tags
+
             auto_load_files        : flags whether to automatically load 
                                      input datasets
                                      
@@ -69,14 +273,25 @@ class ARTMIPStandardizer:
         self.artmip_input_xr = None
         self.original_input_xr = None
 
+        # initialize the coordinate summaries of the input datasets
+        self.artmip_coord_cache = None
+        self.original_coord_cache = None
+
         # initialize the output xarray dataset
         self.output_xr = None
 
+        # initialize the list of output files written
+        self.output_files = []
+
         # store input arguments
         self.artmip_input_files = artmip_input_files
         self.original_input_files = original_input_files
         self.output_file_template = output_file_template
         self.compression_level = compression_level
+        self.compression = compression
+        self.netcdf_chunk_size = netcdf_chunk_size
+        self.num_write_processes = num_write_processes
+        self.bitpack_ar_binary_tag = bitpack_ar_binary_tag
         self.auto_apply_corrections = auto_apply_corrections
         self.metadata_dict = metadata_dict
         self.auto_load_files = auto_load_files
@@ -106,75 +321,112 @@ class ARTMIPStandardizer:
     def load_artmip_input_files(self):
         """ Loads the ARTMIP input files; stores as self.artmip_input_xr """
 
+        # the tag values are written to the output, so fill values and
+        # packing (scale_factor/add_offset) need to be decoded; the time
+        # values are written as-is, so they aren't
         self.artmip_input_xr = xr.open_mfdataset(
             self.artmip_input_files,
+            mask_and_scale = True,
             decode_times = False,
+            decode_timedelta = False,
             combine = 'nested',
-            concat_dim='time')
+            concat_dim='time',
+            data_vars = 'minimal',
+            coords = 'minimal',
+            compat = 'override',
+            parallel = True)
+
+        # summarize the coordinates once for use by the corrections
+        self.artmip_coord_cache = \
+            artmip_corrections.summarize_coordinates(self.artmip_input_xr)
 
     def load_original_input_files(self):
         """ Loads the original input files; stores as self.original_input_xr """
         self.original_input_xr = xr.open_mfdataset(
             self.original_input_files,
+            decode_cf = False,
             decode_times = False,
             combine = 'nested',
-            concat_dim='time')
+            concat_dim='time',
+            data_vars = 'minimal',
+            coords = 'minimal',
+            compat = 'override',
+            parallel = True)
 
         # if we were given metadata, apply it to the input dataset
-        for var, att_dict in self.metadata_dict.items():
-            for att, val in att_dict.items():
-                self.original_input_xr[var].attrs[att] = val
+        if self.metadata_dict is not None:
+            for var, att_dict in self.metadata_dict.items():
+                self.original_input_xr[var].attrs.update(att_dict)
+
+        # summarize the coordinates once for use by the corrections
+        self.original_coord_cache = \
+            artmip_corrections.summarize_coordinates(self.original_input_xr)
 
 
     def determine_corrections(self):
         """ Generates a list of corrections to run on the ARTMIP dataset. """
 
+        # all corrections inspect the same (uncorrected) datasets, so they can
+        # share the coordinate summaries--and the rest of their arguments;
+        # since the datasets aren't modified here, nothing needs invalidating
+        determine_kwargs = dict(
+            artmip_xr = self.artmip_input_xr,
+            input_xr = self.original_input_xr,
+            coord_cache = dict(
+                artmip = self.artmip_coord_cache,
+                input = self.original_coord_cache),
+            )
+
+        # the corrections run in registration order: the longitude fixes
+        # come first, then the time fixes, then the metadata overrides
         for func_name, correction_func in \
             artmip_corrections.all_corrections.items():
 
-            # run through each possible correction
-            # and determine if it should be applied
-            if correction_func(
-                artmip_xr = self.artmip_input_xr,
-                input_xr = self.original_input_xr,
-                determine_only = True) \
-                    == True:
+            # run through each possible correction, determine if it should be
+            # applied, and prepare its application in the same pass
+            needs_correction, apply_func = \
+                artmip_corrections.determine_and_prepare(
+                    correction_func, **determine_kwargs)
+
+            if needs_correction == True:
 
                 self.__add_correction_to_list__(
                     func_name,
                     correction_func,
                     artmip_corrections.all_correction_descriptions[func_name],
+                    apply_func = apply_func,
                     )
 
 
     def apply_corrections(self):
         """ Applies the corrections to the ARTMIP dataset. """
 
-        # set the current xarray dataset
-        current_xr = self.artmip_input_xr
-
-        for correction, correction_func in \
-            self.corrections.items():
-
-            # run through each correction in the list
-            # and apply it
-            output_xr = correction_func(
-                artmip_xr = current_xr,
-                input_xr = self.original_input_xr,
-                apply_only = True)
+        # run through each correction in the list and apply it to the output
+        # of the previous correction (starting with the ARTMIP dataset)
+        self.output_xr = functools.reduce(
+            lambda current_xr, apply_func: apply_func(current_xr),
+            self.corrections.values(),
+            self.artmip_input_xr)
 
-            # use this xarray dataset for the next correction
-            current_xr = output_xr
 
-        self.output_xr = output_xr
-
-
-    def __add_correction_to_list__(self, func_name, func, func_desc = ""):
-        # check the correction function validity
-        artmip_corrections.correction(func, add_to_list = False)
-
-        # add this function to the list of corrections
-        self.corrections[func_name] = func
+    def __add_correction_to_list__(
+        self,
+        func_name,
+        func,
+        func_desc = "",
+        apply_func = None):
+        # check the correction function validity (unless this was already
+        # done when it was registered)
+        if not getattr(func, "_artmip_correction_validated", False):
+            artmip_corrections.correction(func, add_to_list = False)
+
+        # use the correction's apply phase if it wasn't already prepared
+        if apply_func is None:
+            apply_func = artmip_corrections.get_apply_function(
+                func, self.original_input_xr)
+
+        # add the function that applies this correction to the list
+        self.corrections[func_name] = apply_func
 
         # add this function's documentation to the list of corrections
         self.correction_descriptions[func_name] = func_desc
@@ -192,40 +444,93 @@ class ARTMIPStandardizer:
             "; ".join([desc.strip() for f, 
                 desc in self.correction_descriptions.items()])
 
-        # set netCDF options like compression and fill value
-        encoding_dict = {}
-        for var in output_xr.variables:
-            encoding_dict[var] = \
-                {
-                    'zlib': True,
-                    'complevel' : 4,
-                    '_FillValue' : None,
-                }
-
-        # force the time units to be the same for all files
-        encoding_dict["time"]["units"] = \
-            str(output_xr['time'].attrs["units"])
-        encoding_dict["time"]["calendar"] = \
-            str(output_xr['time'].attrs["calendar"])
+        # the original input files are read without CF decoding, so any fill
+        # values copied from them are still variable attributes; drop them
+        # (from a shallow copy), since the output files don't use fill values
+        output_xr = output_xr.copy(deep = False)
+        for var in output_xr.variables.values():
+            var.attrs.pop("_FillValue", None)
+
+        # masked (fill value) cells of the decoded ARTMIP tags are NaN; write
+        # them as 0 (no AR), since the output has no fill value
+        if np.issubdtype(output_xr["ar_binary_tag"].dtype, np.floating):
+            output_xr["ar_binary_tag"] = output_xr["ar_binary_tag"].fillna(0)
 
+        if self.bitpack_ar_binary_tag:
+            output_xr = bitpack_variable(output_xr, "ar_binary_tag", "lon")
+
+        # set netCDF options like compression and fill value
+        if self.compression == "zlib":
+            compression_encoding = { 'zlib': True }
+        else:
+            # other filters (e.g., zstd) require netCDF4 >= 1.6
+            compression_encoding = { 'compression': self.compression }
+        encoding_dict = {
+            var : {
+                **compression_encoding,
+                'complevel' : self.compression_level,
+                '_FillValue' : None,
+            }
+            for var in output_xr.variables }
 
         # ensure that the coordinate data types match the input coordinate data types
         for var in ["time", "lat", "lon"]:
             encoding_dict[var]['dtype'] = str(self.original_input_xr[var].dtype)
 
-        # ensure that ar_binary_tag has byte type
-        encoding_dict['ar_binary_tag'] = dict(dtype="int8")
-
-        # use mfdataset to write to disk
-        output_xr = xr.decode_cf(output_xr) # decode to get the time values
-
-        # group datasets by year
-        years, datasets = zip(*output_xr.groupby("time.year"))
+        # ensure that ar_binary_tag has byte type (keeping its compression)
+        encoding_dict['ar_binary_tag']['dtype'] = \
+            "uint8" if self.bitpack_ar_binary_tag else "int8"
+
+        # chunk time-varying variables along time (other variables are left
+        # contiguous)
+        for var, var_encoding in encoding_dict.items():
+            itemsize = np.dtype(
+                var_encoding.get('dtype', output_xr[var].dtype)).itemsize
+            chunksizes = calculate_chunk_sizes(
+                output_xr[var],
+                itemsize,
+                target_size = self.netcdf_chunk_size)
+            if chunksizes is not None:
+                var_encoding['chunksizes'] = chunksizes
+
+        # group datasets by year; the dataset itself stays encoded (and lazy),
+        # so the time values and their units/calendar attributes are written
+        # to disk as-is
+        years, time_indexers = zip(*get_yearly_time_indexers(
+            output_xr["time"].values,
+            output_xr["time"].attrs["units"],
+            output_xr["time"].attrs.get("calendar", "standard")))
+        datasets = [ output_xr.isel(time = inds) for inds in time_indexers ]
         paths = [ self.output_file_template.format(year = y) for y in years]
-
-        # make the directories
-        for path in paths:
-            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.output_files = paths
+
+        # make the (unique) directories; these are independent, so overlap the
+        # filesystem round trips
+        directories = { os.path.dirname(path) for path in paths }
+        with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as executor:
+            list(executor.map(
+                lambda directory: os.makedirs(directory, exist_ok = True),
+                directories))
+
+        num_processes = min(self.num_write_processes, len(paths))
+        if num_processes > 1:
+            # write each year in its own process; HDF5 serializes all writes
+            # (and compression) within a process, and dask's process scheduler
+            # can't be used here because the netCDF write locks can't be
+            # pickled.  Processes are spawned rather than forked, since forking
+            # a process with open HDF5 files can deadlock.
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers = num_processes,
+                mp_context = multiprocessing.get_context("spawn"),
+                ) as executor:
+                futures = [
+                    executor.submit(write_netcdf_file, ds, path, encoding_dict)
+                    for ds, path in zip(datasets, paths) ]
+                for future in concurrent.futures.as_completed(futures):
+                    path = future.result()
+                    if self.be_verbose:
+                        print(f"Wrote {path}")
+            return
 
         # write to disk
         delayed_write = xr.save_mfdataset(
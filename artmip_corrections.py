@@ -19,6 +19,7 @@ def do_nothing(
     input_xr = None,
     determine_only = False,
     apply_only = False,
+    coord_cache = None,
 ):
 '''Pass the ARTMIP dataset through without modification.'''
 
@@ -33,7 +34,8 @@ def do_nothing(
 
 ```
 
-All correction functions should take four keyword arguments:
+All correction functions should take the following keyword arguments
+(`coord_cache` is optional):
 
     artmip_xr : an `xarray.Dataset` represeting the ARTMIP dataset
 
@@ -45,6 +47,11 @@ All correction functions should take four keyword arguments:
 
     apply_only     : flags whether the correction's apply phase should run
 
+    coord_cache    : an optional dictionary with precomputed coordinate
+                     summaries (see `summarize_coordinates()`) of the ARTMIP
+                     (key 'artmip') and input (key 'input') datasets; it may be
+                     None, in which case summaries are computed as needed
+
 They should also have a short docstring that defines the action that the correction performs (as a verb-phrase).
 
 ## Determination phase
@@ -60,11 +67,21 @@ it returns False otherwise.
 The `apply_only` phase applies the necessary correction to the the input dataset
 and returns the resulting dataset.  An `xarray.Dataset` object should be
 returned.
+
+## Single-pass mode
+
+If neither `determine_only` nor `apply_only` is set, a correction may do both
+phases at once: it returns a tuple `(needs_correction, apply_func)`, where
+`apply_func` takes the ARTMIP dataset (as output by the preceding corrections)
+and returns the corrected dataset.  `apply_func` can capture anything computed
+while determining the correction (e.g., the longitude roll), so it isn't
+computed twice; it may be None if the correction isn't needed.  Corrections
+that don't support this mode are handled by `determine_and_prepare()`, which
+falls back to calling the two phases separately.
 """
 import inspect
 import collections
 import numpy as np
-import xarray as xr
 
 # initialize the list of corrections and their descriptions
 all_corrections = collections.OrderedDict()
@@ -86,6 +103,7 @@ def correction(func, add_to_list = True):
         input_xr = None,
         determine_only = False,
         apply_only = False,
+        coord_cache = None,
     ):
     '''Pass the ARTMIP dataset through without modification.'''
 
@@ -100,7 +118,8 @@ def correction(func, add_to_list = True):
 
     ```
 
-    All correction functions should take four keyword arguments:
+    All correction functions should take the following keyword arguments
+    (`coord_cache` is optional):
 
         artmip_xr : an `xarray.Dataset` represeting the ARTMIP dataset
 
@@ -112,23 +131,30 @@ def correction(func, add_to_list = True):
         
         apply_only     : flags whether the correction's apply phase should run
 
+        coord_cache    : an optional dictionary of coordinate summaries of the
+                         ARTMIP ('artmip') and input ('input') datasets
+
     They should also have a short docstring that defines the action that the
     correction performs (as a verb-phrase).
+
+    With neither phase flag set, corrections may determine and prepare the
+    correction in a single pass by returning `(needs_correction, apply_func)`;
+    see the module docstring.
     
     """
     # check that the function has the expected keyword arguments
     sig = inspect.signature(func)
-    assert 'artmip_xr' in sig.parameters,\
-        "Corrections must take an `artmip_xr` option."
-    assert 'input_xr' in sig.parameters,\
-        "Corrections must take an `input_xr` option."
-    assert 'determine_only' in sig.parameters,\
-        "Corrections must take an `determine_only` option."
-    assert 'apply_only' in sig.parameters,\
-        "Corrections must take an `apply_only` option."
+    for option in ['artmip_xr', 'input_xr', 'determine_only', 'apply_only']:
+        if option not in sig.parameters:
+            raise TypeError(f"Corrections must take an `{option}` option.")
 
     # check that the function has a docstring
-    assert len(func.__doc__) > 0, "Corrections must supply a docstring"
+    if not func.__doc__:
+        raise ValueError("Corrections must supply a docstring")
+
+    # flag that the function has been validated, so that the checks above
+    # don't need to be rerun
+    func._artmip_correction_validated = True
 
     if add_to_list:
         # get the function name
@@ -142,6 +168,170 @@ def correction(func, add_to_list = True):
 
     return func
 
+def summarize_coordinates(xr_ds):
+    """ Summarize the lon and time coordinates of a dataset.
+
+    input:
+    ------
+
+        xr_ds : an `xarray.Dataset` with `lon` and `time` coordinates
+
+    output:
+    -------
+
+        A dictionary of plain NumPy values with the following keys:
+
+            lon_values  : the longitude values
+            lon_min     : the minimum longitude
+            lon_max     : the maximum longitude
+            lon0_idx    : the index of longitude 0 (None if it doesn't exist)
+            time_values : the (undecoded) time values
+            time_len    : the number of times
+
+    """
+    lon = np.asarray(xr_ds.lon.values)
+    time = np.asarray(xr_ds.time.values)
+
+    # determine the location of longitude 0
+    i0 = np.nonzero(lon == 0)[0]
+
+    return dict(
+        lon_values = lon,
+        lon_min = lon.min(),
+        lon_max = lon.max(),
+        lon0_idx = i0[0] if len(i0) > 0 else None,
+        time_values = time,
+        time_len = len(time),
+    )
+
+def get_coordinate_summaries(artmip_xr, input_xr, coord_cache = None):
+    """ Get the coordinate summaries of the ARTMIP and input datasets.
+
+    Summaries are taken from `coord_cache` where available and are computed
+    with `summarize_coordinates()` otherwise.
+
+    output:
+    -------
+
+        A tuple with the ARTMIP and input coordinate summaries.
+
+    """
+    if coord_cache is None:
+        coord_cache = {}
+
+    artmip_coords = coord_cache.get('artmip')
+    if artmip_coords is None:
+        artmip_coords = summarize_coordinates(artmip_xr)
+
+    input_coords = coord_cache.get('input')
+    if input_coords is None:
+        input_coords = summarize_coordinates(input_xr)
+
+    return artmip_coords, input_coords
+
+def get_longitude_roll(artmip_coords, input_coords):
+    """ Get the roll that aligns longitude 0 in the ARTMIP and input longitudes. 
+
+    input:
+    ------
+
+        artmip_coords : the coordinate summary of the ARTMIP dataset
+
+        input_coords  : the coordinate summary of the input dataset
+
+    output:
+    -------
+
+        The number of places the ARTMIP longitudes need to be rolled by.
+
+    """
+    # check that longitude 0 exists in the artmip dataset
+    if artmip_coords['lon0_idx'] is None:
+        raise RuntimeError("Longitude 0 doesn't exist in ARTMIP dataset; it"
+        "is not clear how to proceed")
+
+    # check that longitude 0 exists in the input dataset
+    if input_coords['lon0_idx'] is None:
+        raise RuntimeError("Longitude 0 doesn't exist in input dataset; it"
+        "is not clear how to proceed")
+
+    return input_coords['lon0_idx'] - artmip_coords['lon0_idx']
+
+def get_apply_function(func, input_xr):
+    """ Wrap the apply phase of a correction as a function of the ARTMIP dataset.
+
+    input:
+    ------
+
+        func     : a correction function
+
+        input_xr : the input dataset to pass to the correction
+
+    output:
+    -------
+
+        A function that takes the (possibly already corrected) ARTMIP dataset
+        and returns the output of `func(..., apply_only = True)`.
+
+    """
+    def apply_func(current_xr):
+        return func(
+            artmip_xr = current_xr,
+            input_xr = input_xr,
+            apply_only = True)
+
+    return apply_func
+
+def determine_and_prepare(func, artmip_xr, input_xr, coord_cache = None):
+    """ Determine whether a correction is needed and prepare its application.
+
+    Corrections that support the single-pass mode (neither `determine_only`
+    nor `apply_only` set) do both in one call.  Older corrections, which don't
+    return a `(needs_correction, apply_func)` tuple in that mode, are run
+    through the determination phase instead, and their apply phase is wrapped
+    with `get_apply_function()`.
+
+    input:
+    ------
+
+        func        : a correction function
+
+        artmip_xr   : the ARTMIP dataset
+
+        input_xr    : the input dataset
+
+        coord_cache : optional coordinate summaries of the datasets
+
+    output:
+    -------
+
+        A tuple `(needs_correction, apply_func)`; `apply_func` takes the
+        ARTMIP dataset and returns the corrected dataset.  It may be None if
+        the correction isn't needed.
+
+    """
+    # older corrections don't take the (optional) coord_cache option
+    cache_kwargs = {}
+    if 'coord_cache' in inspect.signature(func).parameters:
+        cache_kwargs['coord_cache'] = coord_cache
+
+    result = func(
+        artmip_xr = artmip_xr,
+        input_xr = input_xr,
+        **cache_kwargs)
+
+    if isinstance(result, tuple):
+        return result
+
+    # fall back to the two-phase protocol
+    needs_correction = func(
+        artmip_xr = artmip_xr,
+        input_xr = input_xr,
+        determine_only = True,
+        **cache_kwargs)
+
+    return needs_correction, get_apply_function(func, input_xr)
+
 # ******************************************************************************
 # ******************************************************************************
 # ************************** Correction functions ******************************
@@ -154,144 +344,137 @@ def swap_lon_convention(
     input_xr = None,
     determine_only = False,
     apply_only = False,
+    coord_cache = None,
     ):
     """ Swap the longitude convention from -180-180 or 0-360. """
+    # with neither phase flagged, determine and prepare the correction at once
+    single_pass = not (determine_only or apply_only)
 
-    if determine_only:
+    # work with the (small) longitude arrays directly
+    artmip_coords, input_coords = get_coordinate_summaries(
+        artmip_xr, input_xr, coord_cache)
+    artmip_lon = artmip_coords['lon_values']
+
+    # figure out if the artmip dataset is 0-360 or -180-180
+    artmip_is_0_360 = \
+        not (artmip_coords['lon_min'] < 0 and artmip_coords['lon_max'] > 0)
+
+    if determine_only or single_pass:
         needs_correction = False
 
-        # check if the input longitudes are identical
-        if all(np.isclose(input_xr.lon.values, artmip_xr.lon.values)):
-            # if they are, nothing needs to be done
-            return False
-
-        # figure out if the input dataset is 0-360 or -180-180
-        if input_xr.lon.min() < 0 and input_xr.lon.max() > 0:
-            input_is_0_360 = False
-        else:
-            input_is_0_360 = True
-
-        # figure out if the artmip dataset is 0-360 or -180-180
-        if artmip_xr.lon.min() < 0 and artmip_xr.max() > 0:
-            artmip_is_0_360 = False
-        else:
-            artmip_is_0_360 = True
-
-        # If they don't have the same convention, this correction needs to be
-        # applied
-        if input_is_0_360 != artmip_is_0_360:
-            needs_correction = True
-        else:
-            # if they have the same convention but longtidues aren't identical,
-            # something is wrong.
-            raise RuntimeError(f"Longitudes aren't identical, but both datasets have the same longitude convention. artmip_xr.lon = {artmip_xr.lon}, input_xr.lon = {input_xr.lon}")
-            
-        # state whether correction needs to be applied
-        return needs_correction
+        input_lon = input_coords['lon_values']
 
-    if apply_only:
+        # check if the input longitudes are identical; if they are, nothing
+        # needs to be done
+        if not (np.array_equal(input_lon, artmip_lon) \
+            or np.allclose(input_lon, artmip_lon)):
 
-        # figure out if the artmip dataset is 0-360 or -180-180
-        if artmip_xr.lon.min() < 0 and artmip_xr.max() > 0:
-            artmip_is_0_360 = False
-        else:
-            artmip_is_0_360 = True
+            # figure out if the input dataset is 0-360 or -180-180
+            input_is_0_360 = \
+                not (input_coords['lon_min'] < 0 and input_coords['lon_max'] > 0)
 
-        # fix the longitudes (multiply by one to change from an immutable
-        # indexarray to a mutable dataarray)
-        lon = artmip_xr.lon
-        if artmip_is_0_360:
-            lon = xr.where(lon > 180, lon - 360, lon)
-        else:
-            lon = xr.where(lon < 0, lon + 360, lon)
+            # If they don't have the same convention, this correction needs to
+            # be applied
+            if input_is_0_360 != artmip_is_0_360:
+                needs_correction = True
+            else:
+                # if they have the same convention but longtidues aren't
+                # identical, something is wrong.
+                raise RuntimeError(f"Longitudes aren't identical, but both datasets have the same longitude convention. artmip_xr.lon = {artmip_xr.lon}, input_xr.lon = {input_xr.lon}")
 
-        # replace the coordinate
-        output_xr = artmip_xr.assign_coords(lon = lon)
+        # state whether correction needs to be applied
+        if determine_only:
+            return needs_correction
+        if not needs_correction:
+            return False, None
 
-        return output_xr
+    # fix the longitudes
+    if artmip_is_0_360:
+        lon = np.where(artmip_lon > 180, artmip_lon - 360, artmip_lon)
+    else:
+        lon = np.where(artmip_lon < 0, artmip_lon + 360, artmip_lon)
+
+    def apply_func(current_xr):
+        # replace the coordinate (keeping its metadata)
+        return current_xr.assign_coords(
+            lon = ("lon", lon, current_xr.lon.attrs))
+
+    if apply_only:
+        return apply_func(artmip_xr)
+
+    return True, apply_func
 
 @correction
 def rotate_longitudes(
     artmip_xr = None,
     input_xr = None,
     determine_only = False,
-    apply_only = False
+    apply_only = False,
+    coord_cache = None,
     ):
     """ Rotate through the longitude dimension to match the input dataset. """
+    # with neither phase flagged, determine and prepare the correction at once
+    single_pass = not (determine_only or apply_only)
 
-    if determine_only:
-        needs_correction = False
-
-        # check if the input longitudes are identical
-        if all(np.isclose(input_xr.lon, artmip_xr.lon)):
-            # if they are, nothing needs to be done
-            return False
+    # work with the (small) longitude arrays directly
+    artmip_coords, input_coords = get_coordinate_summaries(
+        artmip_xr, input_xr, coord_cache)
+    artmip_lon = artmip_coords['lon_values']
+    input_lon = input_coords['lon_values']
 
-        # determine the location of longitude 0 in the artmip dataset
-        try:
-            i0_artmip = np.nonzero(artmip_xr.lon.values == 0)[0][0]
-        except:
-            raise RuntimeError("Longitude 0 doesn't exist in ARTMIP dataset; it"
-            "is not clear how to proceed")
+    if determine_only or single_pass:
+        needs_correction = False
 
-        # determine the location of longitude 0 in the input dataset
-        try:
-            i0_input = np.nonzero(input_xr.lon.values == 0)[0][0]
-        except:
-            raise RuntimeError("Longitude 0 doesn't exist in input dataset; it"
-            "is not clear how to proceed")
-            
-        nroll = i0_input - i0_artmip
-        if nroll == 0:
-            # if longitude 0 overlaps, nothing needs to be done
-            return False
-
-        # check if rolling the longitude fixes it
-        rolled_lon = artmip_xr.lon.roll(lon = nroll)
-
-        # if longitudes aren't identical, assume that 
-        # the latlon convention will have to be changed
-        if not all(np.isclose(input_xr.lon.values, rolled_lon.values)):
-            # change from -180 to 180 to 0 to 360
-            if rolled_lon.min() < 0:
-                rolled_lon = xr.where(
-                    rolled_lon < 0, rolled_lon + 360, rolled_lon)
+        # check if the input longitudes are identical; if they are, nothing
+        # needs to be done
+        nroll = 0
+        if not (np.array_equal(input_lon, artmip_lon) \
+            or np.allclose(input_lon, artmip_lon)):
+            # determine how far longitude 0 is offset between the datasets
+            nroll = get_longitude_roll(artmip_coords, input_coords)
+
+        # if longitude 0 overlaps, nothing needs to be done
+        if nroll != 0:
+            # check if rolling the longitude fixes it
+            rolled_lon = np.roll(artmip_lon, nroll)
+
+            # if longitudes aren't identical, assume that 
+            # the latlon convention will have to be changed
+            if not np.allclose(input_lon, rolled_lon):
+                # change from -180 to 180 to 0 to 360
+                if rolled_lon.min() < 0:
+                    rolled_lon = np.where(
+                        rolled_lon < 0, rolled_lon + 360, rolled_lon)
+                else:
+                    # change from 0 to 360 to -180 to 180
+                    rolled_lon = np.where(
+                        rolled_lon > 180, rolled_lon - 360, rolled_lon)
+
+            # if rolling worked, we need the correction
+            if np.allclose(input_lon, rolled_lon):
+                needs_correction = True
             else:
-                # change from 0 to 360 to -180 to 180
-                rolled_lon = xr.where(
-                    rolled_lon > 180, rolled_lon - 360, rolled_lon)
+                # if not, then something unexpected is going on
+                raise RuntimeError(f"Longitudes aren't identical, but rolling lon didn't fix the problem. rolled_lon = {rolled_lon}, input_xr.lon = {input_lon}")
 
-        # if rolling worked, we need the correction
-        if all(np.isclose(input_xr.lon.values, rolled_lon.values)):
-            needs_correction = True
-        else:
-            # if not, then something unexpected is going on
-            raise RuntimeError(f"Longitudes aren't identical, but rolling lon didn't fix the problem. rolled_lon = {rolled_lon.values}, input_xr.lon = {input_xr.lon.values}")
-            
         # state whether the correction needs to be applied
-        return needs_correction
+        if determine_only:
+            return needs_correction
+        if not needs_correction:
+            return False, None
+    else:
+        # determine how far longitude 0 is offset between the datasets
+        nroll = get_longitude_roll(artmip_coords, input_coords)
+
+    def apply_func(current_xr):
+        # roll along the longitude dimension; swapping the longitude
+        # convention doesn't move longitude 0, so `nroll` still holds
+        return current_xr.roll(lon = nroll, roll_coords = True)
 
     if apply_only:
-        # determine the location of longitude 0 in the artmip dataset
-        try:
-            i0_artmip = np.nonzero(artmip_xr.lon.values == 0)[0][0]
-        except:
-            raise RuntimeError("Longitude 0 doesn't exist in ARTMIP dataset; it"
-            "is not clear how to proceed")
-
-        # determine the location of longitude 0 in the input dataset
-        try:
-            i0_input = np.nonzero(input_xr.lon.values == 0)[0][0]
-        except:
-            raise RuntimeError("Longitude 0 doesn't exist in input dataset; it"
-            "is not clear how to proceed")
-            
-        nroll = i0_input - i0_artmip
+        return apply_func(artmip_xr)
 
-        # roll along the longitude dimension
-        output_xr = artmip_xr.roll(lon = nroll, roll_coords = True)
-
-        return output_xr
+    return True, apply_func
 
 @correction
 def insert_missing_times(
@@ -299,12 +482,19 @@ def insert_missing_times(
     input_xr = None,
     determine_only = False,
     apply_only = False,
+    coord_cache = None,
     ):
     """ Insert missing timesteps (fills with _FillValue). """
-    if determine_only:
+    # with neither phase flagged, determine and prepare the correction at once
+    single_pass = not (determine_only or apply_only)
+
+    artmip_coords, input_coords = get_coordinate_summaries(
+        artmip_xr, input_xr, coord_cache)
+
+    if determine_only or single_pass:
         needs_correction = False
 
-        if len(input_xr.time) != len(artmip_xr.time):
+        if input_coords['time_len'] != artmip_coords['time_len']:
             needs_correction = True
 
             # double-check that the output times are a superset of the inputs
@@ -313,33 +503,54 @@ def insert_missing_times(
             except:
                 raise RuntimeError("ARTMIP time values don't match those of the input; cannot determine how to sensibly modify the time dimension of the ARTMIP dataset.")
 
-        return needs_correction
-
-    if apply_only:
-
-        # reindex the dataset to augment the times 
-        output_xr = artmip_xr.reindex(
+        if determine_only:
+            return needs_correction
+        if not needs_correction:
+            return False, None
+
+    def apply_func(current_xr):
+        # use a zero fill value with the dtype of each variable, so that the
+        # fill doesn't promote (e.g.) the int8 ar_binary_tag to a wider type
+        fill_values = {
+            var : current_xr[var].dtype.type(0) \
+                for var in current_xr.data_vars }
+
+        # reindex the dataset to augment the times; this keeps dask-backed
+        # (i.e., lazily loaded) datasets lazy
+        output_xr = current_xr.reindex(
             dict(time = input_xr.time),
-            fill_value = 0,
+            fill_value = fill_values,
             copy = False)
 
         return output_xr
 
+    if apply_only:
+        return apply_func(artmip_xr)
+
+    return True, apply_func
+
 @correction
 def override_time_values_and_metadata(
     artmip_xr = None,
     input_xr = None,
     determine_only = False,
     apply_only = False,
+    coord_cache = None,
     ):
     """ Override the time values and metadata with that from the input. """
+    # with neither phase flagged, determine and prepare the correction at once
+    single_pass = not (determine_only or apply_only)
 
-    if determine_only:
+    if determine_only or single_pass:
         needs_correction = False
 
+        artmip_coords, input_coords = get_coordinate_summaries(
+            artmip_xr, input_xr, coord_cache)
+
         try:
             # check if the time values are all close
-            if not np.allclose(input_xr.time.values, artmip_xr.time.values):
+            if not np.allclose(
+                input_coords['time_values'], artmip_coords['time_values']):
                 needs_correction = True
         except ValueError:
             # the above might not work if the dataset is missing time values
@@ -358,13 +569,19 @@ def override_time_values_and_metadata(
                 # one of the attributes is missing; override them
                 needs_correction = True
 
-        return needs_correction
+        if determine_only:
+            return needs_correction
+        if not needs_correction:
+            return False, None
 
-    if apply_only:
+    def apply_func(current_xr):
         # copy the time coordinate from the input dataset
-        output_xr = artmip_xr.assign_coords(time = input_xr.time)
+        return current_xr.assign_coords(time = input_xr.time)
 
-        return output_xr
+    if apply_only:
+        return apply_func(artmip_xr)
+
+    return True, apply_func
 
 @correction
 def override_coordinate_metadata(
@@ -372,12 +589,16 @@ def override_coordinate_metadata(
     input_xr = None,
     determine_only = False,
     apply_only = False,
+    coord_cache = None,
     ):
     """ Override the lat/lon coordinate metadata with that from the input. """
+    # with neither phase flagged, determine and prepare the correction at once
+    single_pass = not (determine_only or apply_only)
+
     check_coords = ["lat", "lon"]
     check_atts = ["long_name", "units", "standard_name"]
 
-    if determine_only:
+    if determine_only or single_pass:
         needs_correction = False
 
         # check if the long name, units, and standard name all match
@@ -392,13 +613,36 @@ def override_coordinate_metadata(
                     # one of the attributes is missing; override them
                     needs_correction = True
 
-        return needs_correction
+        if determine_only:
+            return needs_correction
+        if not needs_correction:
+            return False, None
+
+    # find the coordinate metadata that differ from the input dataset (the
+    # preceding corrections keep the lat/lon metadata)
+    differing_atts = [ (coord, att) \
+        for coord in check_coords for att in check_atts \
+        if input_xr[coord].attrs.get(att) \
+            != artmip_xr[coord].attrs.get(att) ]
+
+    # group the differing metadata by coordinate
+    new_atts = collections.defaultdict(dict)
+    for coord, att in differing_atts:
+        new_atts[coord][att] = input_xr[coord].attrs[att]
+
+    def apply_func(current_xr):
+        # if all of the metadata already match, pass the dataset through
+        if len(new_atts) == 0:
+            return current_xr
+
+        output_xr = current_xr.copy(deep = False)
+        # copy the differing coordinate metadata from the input dataset
+        for coord, att_dict in new_atts.items():
+            output_xr[coord].attrs.update(att_dict)
+
+        return output_xr
 
     if apply_only:
-        output_xr = artmip_xr.copy()
-        # copy the coordinate metadata from the input dataset
-        for coord in check_coords:
-            for att in check_atts:
-                output_xr[coord].attrs[att] = input_xr[coord].attrs[att]
+        return apply_func(artmip_xr)
 
-        return output_xr
\ No newline at end of file
+    return True, apply_func
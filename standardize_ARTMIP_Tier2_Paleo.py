@@ -1,40 +1,70 @@
 """ Standardizes files in the ARTMIP Tier 2 Paleo experiment. """
+import os
+import sys
 import glob
+import fnmatch
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import pickle
+import time
+import traceback
+import types
+import numpy as np
+import ARTMIPStandardizer as ARTMIPStandardizer_module
 from ARTMIPStandardizer import ARTMIPStandardizer
+import artmip_corrections
 import argparse
-import simplempi.simpleMPI as simpleMPI
 
-# initialize MPI
-smpi = simpleMPI.simpleMPI()
+# the simpleMPI instance; MPI is initialized in `main()`, after the command line
+# options are parsed
+smpi = None
 
 def vprint(*args, **kwargs):
-    if smpi.rank == 0:
+    if smpi is None or smpi.rank == 0:
         print(*args, **kwargs)
 
+def abort_on_exception(exc_type, exc_value, exc_traceback):
+    """ Print an uncaught exception and abort all MPI ranks.
+
+    This is installed as `sys.excepthook` when running on more than one rank;
+    otherwise, the other ranks would wait forever on messages from (or
+    to) the failed rank.
+    """
+    sys.__excepthook__(exc_type, exc_value, exc_traceback)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    smpi.comm.Abort(1)
+
 # define the time, lat, and, lon attributes to enforce
-# for all files
-coord_override_dict = dict(
-    time = {
+# for all files; these are read-only, since each task gets its own copy (see
+# `get_metadata_dict()`)
+coord_override_dict = types.MappingProxyType(dict(
+    time = types.MappingProxyType({
         "long_name" : "time",
         "units" : "days since 0001-01-01 00:00:00",
         "calendar" : "365_day",
         "standard_name" : "time",
-    },
-    lat = {
+    }),
+    lat = types.MappingProxyType({
         "long_name" : "latitude",
         "units" : "degrees_north",
         "standard_name" : "latitude",
-    },
-    lon = {
+    }),
+    lon = types.MappingProxyType({
         "long_name" : "longitude",
         "units" : "degrees_east",
         "standard_name" : "longitude",
-    },
-)
+    }),
+))
 
 # set the experiments
-experiments=["PreIndust", "PI_21ka-CO2", "10ka-Orbital"]
-algorithms=[ \
+default_experiments=["PreIndust", "PI_21ka-CO2", "10ka-Orbital"]
+default_algorithms=[ \
     "ARCONNECT_v2",
     "Brands_v1.1",
     "IDL_v2b.perc_PreIndust",
@@ -51,50 +81,6 @@ algorithms=[ \
     "Guan_Waliser_v2",
     ]
 
-def list_algs_and_quit():
-    for alg in algorithms:
-        vprint(alg)
-    quit()
-
-def list_experiments_and_quit():
-    for exp in experiments:
-        vprint(exp)
-    quit()
-
-# parse the command line options
-parser = argparse.ArgumentParser()
-parser.add_argument("--algs", default = None, nargs='+',
-    help="Algorithm(s) to run on.")
-parser.add_argument("--exps", default = None, nargs='+',
-    help="Experiment(s) to run on.")
-parser.add_argument("--list_algs", default = False, action="store_true",
-    help="Lists all valid algorithms")
-parser.add_argument("--list_exps", default = False, action="store_true",
-    help="Lists all valid experiments")
-args = parser.parse_args()
-parser_algs = args.algs
-parser_exps = args.exps
-if args.list_algs:
-    list_algs_and_quit()
-if args.list_exps:
-    list_experiments_and_quit()
-# get the list of algorithms to run on
-if parser_algs is not None:
-    # check that algorithms are valid
-    for alg in parser_algs:
-        assert alg in algorithms, f"Algorithm `{alg}` is not in the list of valid algorithms"
-    # use this list of algorithms
-    algorithms = parser_algs
-
-# get the list of experiments to run on
-if parser_exps is not None:
-    # check that experiments are valid
-    for exp in parser_exps:
-        assert exp in experiments, f"Experiment `{exp}` is not in the list of valid experiments"
-    # use this list of experiments
-    experiments = parser_exps
-
-
 # note: the above list is alphabetical, except that GW_v2 is at the bottom
 # because it takes substantially longer than the others due to level 9
 # compression having been used.
@@ -104,89 +90,649 @@ output_base = "/N/scratch/obrienta/PaleoARTMIP/standardized_dataset/"
 input_file_glob_template = "/N/scratch/obrienta/PaleoARTMIP/{experiment}/IVT.cam.h2.*.nc"
 output_file_template = output_base + "/{algorithm}/{experiment}/{experiment}.ar_tag.{algorithm}.6hr.{{year:04}}.nc4"
 
+# the manifest of completed tasks, used to skip tasks whose outputs are up to
+# date, and the maximum number of tasks it remembers; concurrent jobs share the
+# manifest, taking turns updating it by locking `cache_lock_path`
+cache_manifest_path = output_base + "/.cache.json"
+cache_lock_path = output_base + "/.cache.lock"
+max_cache_entries = 1024
 
-input_paths = {alg : {} for alg in algorithms}
-for alg in algorithms:
-    # initialize the input path using the file layout that several experiments
-    # use
-    glob_template = f"{input_base}/{alg}/{{experiment}}/*ar_tag*.nc4"
-    
-    for experiment in experiments:
+# the seed of the shuffled task order
+task_shuffle_seed = 0
 
-        # set the default glob pattern
-        glob_pattern = glob_template.format(experiment = experiment)
+# the results of the last file discovery, reused while none of the directories
+# that were searched have changed; each set of algorithms and experiments (see
+# `get_discovery_manifest_path()`) has its own manifest, so that concurrent jobs
+# on different subsets don't overwrite each other's
+discovery_manifest_template = output_base + "/.discovery_manifest.{subset}.json"
 
-        # fix issues with individual algorithm layouts
-        if alg == "IPART_v1":
-            exp_tmp = experiment
-            if experiment == "10ka-Orbital":
-                # fix a spelling problem
-                exp_tmp = "10ka_Orbital"
-            glob_pattern = f"{input_base}/IPART/{exp_tmp}/*ar_tag*.nc4"
 
-        if alg == "TE_v2.1":
-            exp_tmp = experiment
-            if experiment == "10ka-Orbital":
-                # fix a spelling problem
-                exp_tmp = "10ka-Orbitak"
-            glob_pattern = f"{input_base}/Tempest/{exp_tmp}/*ar_tag*.nc4"
+# the glob patterns of the ARTMIP files; most algorithms use the default
+# layout, but some have their own (each rule takes the algorithm and experiment)
+def default_glob_rule(alg, exp):
+    return f"{input_base}/{alg}/{exp}/*ar_tag*.nc4"
 
-        if alg == "Shields_v1":
-            glob_pattern = f"{input_base}/shields/{experiment}*ar_tag*.nc4"
+alg_glob_rules = {
+    # fix a spelling problem
+    "IPART_v1" : lambda alg, exp: f"{input_base}/IPART/" \
+        f"{'10ka_Orbital' if exp == '10ka-Orbital' else exp}/*ar_tag*.nc4",
+    # fix a spelling problem
+    "TE_v2.1" : lambda alg, exp: f"{input_base}/Tempest/" \
+        f"{'10ka-Orbitak' if exp == '10ka-Orbital' else exp}/*ar_tag*.nc4",
+    "Shields_v1" : lambda alg, exp: \
+        f"{input_base}/shields/{exp}*ar_tag*.nc4",
+    "Brands_v1.1" : lambda alg, exp: \
+        f"{input_base}/Brands/brands_v1.1/{exp}/*ar_tag*.nc4",
+    "Guan_Waliser_v2" : lambda alg, exp: \
+        f"{input_base}/Guan_Waliser/Paleo/{exp}*ar_tag*.nc4",
+    # families of algorithms (see `get_alg_family()`)
+    "Reid" : lambda alg, exp: \
+        f"{input_base}/Reid/{exp}/*ar_tag.{alg}.*.nc4",
+    "IDL" : lambda alg, exp: \
+        f"{input_base}/IDL/{exp}.ar_tag.{alg}*.nc4",
+}
 
-        if alg == "Brands_v1.1":
-            glob_pattern = f"{input_base}/Brands/brands_v1.1/{experiment}/*ar_tag*.nc4"
+def get_alg_family(alg):
+    """ Get the family of an algorithm (e.g., Reid250 -> Reid); algorithms
+    that aren't part of a family are their own family. """
+    if alg.startswith("IDL"):
+        return "IDL"
+    if "Reid" in alg:
+        return "Reid"
+    return alg
 
-        if alg == "Guan_Waliser_v2":
-            glob_pattern = f"{input_base}/Guan_Waliser/Paleo/{experiment}*ar_tag*.nc4"
+def get_glob_rule(alg):
+    """ Get the glob rule for an algorithm. """
+    return alg_glob_rules.get(get_alg_family(alg), default_glob_rule)
 
-        if "Reid" in alg:
-            glob_pattern = f"{input_base}/Reid/{experiment}/*ar_tag.{alg}.*.nc4"
+# the names in each directory listed so far, so that each directory is only
+# listed once no matter how many patterns are matched against it, and the
+# modification times of those directories
+dir_cache = {}
+dir_mtimes = {}
 
-        if alg[:3] == "IDL":
-            glob_pattern = f"{input_base}/IDL/{experiment}.ar_tag.{alg}*.nc4"
+# whether any pattern was matched with `glob.glob()`, which searches
+# directories that aren't tracked in `dir_mtimes`
+used_untracked_glob = False
 
-        nfiles = len(glob.glob(glob_pattern))
+def get_dir_mtime(directory):
+    """ Get the modification time of a directory (None if it doesn't exist). """
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
 
-        # try a flat layout if none were found after all the modifications above
-        if nfiles == 0:
-            glob_pattern = f"{input_base}/{alg}/{experiment}*ar_tag*.nc4"
-            nfiles = len(glob.glob(glob_pattern))
+def list_directory(directory):
+    """ List the names in a directory (cached; empty if it doesn't exist). """
+    if directory not in dir_cache:
+        # get the modification time first, so that changes made while listing
+        # the directory show up as a newer modification time
+        dir_mtimes[directory] = get_dir_mtime(directory)
+        try:
+            with os.scandir(directory) as entries:
+                dir_cache[directory] = [ entry.name for entry in entries ]
+        except OSError:
+            dir_cache[directory] = []
+    return dir_cache[directory]
 
-        # test again
-        nfiles = len(glob.glob(glob_pattern))
-        assert nfiles > 0, \
-            f"Algorithm `{alg}`, experiment `{experiment}` has no files."
+def find_files(glob_pattern):
+    """ Find the files matching a glob pattern, sorted.
 
-        # store the glob pattern
-        input_paths[alg][experiment] = glob_pattern
-        
-        vprint(f"{alg}\t{experiment}\t{nfiles}")
-vprint()
+    Patterns with wildcards only in the file name are matched against the
+    (cached) directory listing; other patterns fall back to `glob.glob()`.
+    """
+    global used_untracked_glob
 
-alg_exp_list = [ (exp, alg) for exp in experiments for alg in algorithms]
-my_alg_exp_list = smpi.scatterList(alg_exp_list)
+    directory, name_pattern = os.path.split(glob_pattern)
+    if glob.has_magic(directory):
+        used_untracked_glob = True
+        return sorted(glob.glob(glob_pattern))
 
-# loop over algorithms and experiments and run the standardizer
-for exp, alg in my_alg_exp_list:
-    glob_pattern = input_paths[alg][exp]
+    # like glob, only match hidden files if the pattern asks for them
+    names = fnmatch.filter(list_directory(directory), name_pattern)
+    if not name_pattern.startswith("."):
+        names = [ name for name in names if not name.startswith(".") ]
 
-    # fix the time units for each experiment
+    return sorted(os.path.join(directory, name) for name in names)
+
+def get_time_units(exp):
+    """ Get the time units of an experiment. """
     if exp == "10ka-Orbital":
-        coord_override_dict["time"]["units"] \
-            = "days since 0201-01-01 00:00:00"
+        return "days since 0201-01-01 00:00:00"
+    return "days since 0001-01-01 00:00:00"
+
+def get_metadata_dict(time_units):
+    """ Get the coordinate metadata to enforce, with the given time units.
+
+    This is a (mutable) copy of the read-only `coord_override_dict`, so tasks
+    never share their metadata.
+    """
+    metadata_dict = { coord : dict(atts) \
+        for coord, atts in coord_override_dict.items() }
+    metadata_dict["time"]["units"] = time_units
+    return metadata_dict
+
+def broadcast_object(obj, root = 0):
+    """ Broadcast a (picklable) object from rank `root` to all other ranks.
+
+    The object is pickled once and sent as a raw byte buffer: first its size,
+    then its contents, using MPI's buffer-based `Bcast`.
+    """
+    from mpi4py import MPI
+
+    size = np.zeros(1, dtype = np.int64)
+    if smpi.rank == root:
+        buf = bytearray(pickle.dumps(obj, protocol = 5))
+        size[0] = len(buf)
+
+    smpi.comm.Bcast(size, root = root)
+    if smpi.rank != root:
+        buf = bytearray(int(size[0]))
+    smpi.comm.Bcast([buf, MPI.BYTE], root = root)
+
+    return pickle.loads(buf)
+
+def find_artmip_files(alg, experiment, glob_rule):
+    """ Find the ARTMIP files of an algorithm and experiment, using the
+    algorithm's glob rule. """
+    # glob once and reuse the file list (sorted, as open_mfdataset would
+    # sort the files matched by a pattern)
+    files = find_files(glob_rule(alg, experiment))
+
+    # try a flat layout if none were found after all the modifications above
+    if len(files) == 0:
+        files = find_files(f"{input_base}/{alg}/{experiment}*ar_tag*.nc4")
+
+    return files
+
+def discover_input_paths(algorithms, experiments):
+    """ Find the ARTMIP files and settings of each algorithm and experiment.
+
+    output:
+    -------
+
+        A dictionary (keyed by algorithm, then experiment) of task settings:
+        the ARTMIP file list (`files`), the IVT file list (`ivt_files`), the
+        output file template (`out_tmpl`), and the time units (`time_units`).
+
+    """
+    # look up each algorithm's glob rule once
+    glob_rules = { alg : get_glob_rule(alg) for alg in algorithms }
+
+    # directory listings are dominated by filesystem latency, so overlap them
+    alg_exp_pairs = [ (alg, exp) for alg in algorithms for exp in experiments ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 32) as executor:
+        found_files = list(executor.map(
+            lambda pair: find_artmip_files(*pair, glob_rules[pair[0]]),
+            alg_exp_pairs))
+
+        # find the IVT files once per experiment (all algorithms share them)
+        found_ivt_files = dict(zip(experiments, executor.map(
+            lambda exp: find_files(
+                input_file_glob_template.format(experiment = exp)),
+            experiments)))
+
+    # store the settings of each task (including the file list, so that it
+    # doesn't need to be globbed again)
+    input_paths = {alg : {} for alg in algorithms}
+    for (alg, experiment), files in zip(alg_exp_pairs, found_files):
+        input_paths[alg][experiment] = dict(
+            files = files,
+            ivt_files = found_ivt_files[experiment],
+            out_tmpl = output_file_template.format(
+                algorithm = alg, experiment = experiment),
+            time_units = get_time_units(experiment),
+        )
+
+    return input_paths
+
+def get_code_version():
+    """ Hash the source of the standardizer, its corrections, and this script
+    (which sets the standardizer's options in `standardize()`). """
+    sha = hashlib.sha1()
+    for path in [ARTMIPStandardizer_module.__file__,
+                 artmip_corrections.__file__, __file__]:
+        with open(path, "rb") as fin:
+            sha.update(fin.read())
+    return sha.hexdigest()
+
+def get_task_hash(exp, alg, task, code_version):
+    """ Hash the inputs (paths, modification times, and sizes), metadata, and
+    code version of a task. """
+    sha = hashlib.sha1()
+    sha.update(code_version.encode())
+    sha.update(json.dumps(
+        [exp, alg, task["out_tmpl"], get_metadata_dict(task["time_units"])],
+        sort_keys = True).encode())
+    for path in task["files"] + task["ivt_files"]:
+        stat = os.stat(path)
+        sha.update(f"{path}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+    return sha.hexdigest()
+
+def get_output_stats(paths):
+    """ Get the modification time and size of each output file (None for
+    files that don't exist); a task's outputs are only reused if these haven't
+    changed since the task completed, so that outputs that were (partially)
+    rewritten by a later, failed run of the task aren't kept. """
+    output_stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            output_stats[path] = None
+        else:
+            output_stats[path] = [stat.st_mtime_ns, stat.st_size]
+    return output_stats
+
+def write_json_atomically(obj, path):
+    """ Write an object to a JSON file; the file is written to a temporary
+    file first and moved into place, so it is never partially written. """
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fout:
+        json.dump(obj, fout, indent = 1)
+    os.replace(tmp_path, path)
+
+@contextlib.contextmanager
+def locked_file(path):
+    """ Hold an exclusive lock on the file `path` (creating it if needed) for
+    the duration of a `with` block. """
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "a") as flock:
+        fcntl.flock(flock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(flock, fcntl.LOCK_UN)
+
+def get_discovery_key(algorithms, experiments):
+    """ Hash what file discovery depends on, other than the filesystem: the
+    algorithms, experiments, and this script (which defines the file layouts).
+    """
+    sha = hashlib.sha1()
+    sha.update(json.dumps([algorithms, experiments]).encode())
+    with open(__file__, "rb") as fin:
+        sha.update(fin.read())
+    return sha.hexdigest()
+
+def get_discovery_manifest_path(algorithms, experiments):
+    """ Get the path of the discovery manifest for a set of algorithms and
+    experiments. """
+    subset = hashlib.sha1(
+        json.dumps([algorithms, experiments]).encode()).hexdigest()[:16]
+    return discovery_manifest_template.format(subset = subset)
+
+def load_discovery_manifest(manifest_path, discovery_key):
+    """ Load the results of a previous file discovery from `manifest_path`.
+
+    output:
+    -------
+
+        The `input_paths` dictionary (see `discover_input_paths()`), or None
+        if there is no manifest for `discovery_key` or if any of the searched
+        directories have changed since.
+
+    """
+    try:
+        with open(manifest_path) as fin:
+            manifest = json.load(fin)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("key") != discovery_key:
+        return None
+
+    # check whether files have been added to or removed from any directory
+    for directory, mtime in manifest["dir_mtimes"].items():
+        if get_dir_mtime(directory) != mtime:
+            return None
+
+    return manifest["input_paths"]
+
+def save_discovery_manifest(manifest_path, discovery_key, input_paths):
+    """ Save the results of file discovery to `manifest_path` (unless they
+    can't be validated). """
+    if used_untracked_glob:
+        return
+
+    write_json_atomically(
+        dict(key = discovery_key, dir_mtimes = dir_mtimes,
+             input_paths = input_paths),
+        manifest_path)
+
+def load_cache_manifest():
+    """ Load the cache manifest (empty if it doesn't exist or is unreadable). """
+    try:
+        with open(cache_manifest_path) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache_manifest(manifest):
+    """ Write the cache manifest atomically, evicting the least recently used
+    entries beyond `max_cache_entries`.
+
+    Other jobs (e.g., running other algorithms) may have updated the manifest
+    since it was loaded, so their entries are merged into `manifest` first,
+    keeping the most recently used version of each entry.
+    """
+    with locked_file(cache_lock_path):
+        for key, entry in load_cache_manifest().items():
+            if key not in manifest \
+                or entry["last_used"] > manifest[key]["last_used"]:
+                manifest[key] = entry
+
+        num_evict = len(manifest) - max_cache_entries
+        if num_evict > 0:
+            for key in sorted(manifest, key = lambda k: manifest[k]["last_used"]) \
+                [:num_evict]:
+                del manifest[key]
+
+        write_json_atomically(manifest, cache_manifest_path)
+
+def standardize(exp, alg, task):
+    """ Run the standardizer on one experiment and algorithm; returns the
+    output files. """
+    # this may run in a worker process, where MPI isn't initialized
+    message = f"Standardizing {alg}:{exp}"
+    if smpi is not None:
+        smpi.pprint(message)
     else:
-        coord_override_dict["time"]["units"] \
-            = "days since 0001-01-01 00:00:00"
-
-    smpi.pprint(f"Standardizing {alg}:{exp}")
-    ARTMIPStandardizer(
-        glob_pattern,
-        input_file_glob_template.format(experiment = exp),
-        output_file_template=output_file_template.format(
-            algorithm = alg, experiment = exp),
-        metadata_dict = coord_override_dict,
+        print(message)
+    standardizer = ARTMIPStandardizer(
+        task["files"],
+        task["ivt_files"],
+        output_file_template=task["out_tmpl"],
+        metadata_dict = get_metadata_dict(task["time_units"]),
         be_verbose=False,
     )
 
-smpi.pprint("Done.")
\ No newline at end of file
+    return standardizer.output_files
+
+def run_task(exp, alg, task):
+    """ Run one task; returns the arguments of `record_task()`. """
+    return exp, alg, standardize(exp, alg, task)
+
+def get_task_result(future, task):
+    """ Get the result of a finished task.
+
+    input:
+    ------
+        future : the finished `concurrent.futures.Future` of `run_task()`
+
+        task   : the task's `(exp, alg)` tuple
+
+    output:
+    -------
+        a tuple `(exp, alg, output_files, error)`, where `error` is the
+        formatted traceback if the task failed (and `output_files` is None),
+        or None if it succeeded
+    """
+    exp, alg = task
+    error = future.exception()
+    if error is not None:
+        return exp, alg, None, "".join(
+            traceback.format_exception(type(error), error, error.__traceback__))
+
+    return (*future.result(), None)
+
+def get_task_executor(tasks_per_rank):
+    """ Returns an executor that runs up to `tasks_per_rank` tasks at once.
+
+    input:
+    ------
+        tasks_per_rank : the number of tasks to run at once
+
+    output:
+    -------
+        a concurrent.futures executor
+
+    A single task runs in a thread (leaving the main thread free for MPI);
+    more than one run in spawned processes, since HDF5 can't safely be used
+    from several threads at once and forking a process with open HDF5 files
+    can deadlock.
+    """
+    if tasks_per_rank == 1:
+        return concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers = tasks_per_rank,
+        mp_context = multiprocessing.get_context("spawn"),
+        )
+
+def main():
+    global smpi
+
+    experiments = default_experiments
+    algorithms = default_algorithms
+
+    # parse the command line options
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algs", default = None, nargs='+',
+        help="Algorithm(s) to run on.")
+    parser.add_argument("--exps", default = None, nargs='+',
+        help="Experiment(s) to run on.")
+    parser.add_argument("--list_algs", default = False, action="store_true",
+        help="Lists all valid algorithms")
+    parser.add_argument("--list_exps", default = False, action="store_true",
+        help="Lists all valid experiments")
+    parser.add_argument("--ignore_cache", default = False, action="store_true",
+        help="Rerun file discovery and all tasks, even those whose outputs are "
+             "up to date")
+    parser.add_argument("--tasks_per_rank", default = 1, type = int,
+        help="Number of tasks each rank runs at once (in separate processes)")
+    args = parser.parse_args()
+    parser_algs = args.algs
+    parser_exps = args.exps
+
+    # list the algorithms or experiments and exit, before initializing MPI
+    if args.list_algs:
+        for alg in algorithms:
+            print(alg)
+        sys.exit(0)
+    if args.list_exps:
+        for exp in experiments:
+            print(exp)
+        sys.exit(0)
+
+    # get the list of algorithms to run on
+    if parser_algs is not None:
+        # check that algorithms are valid (reporting all invalid ones at once)
+        invalid_algs = set(parser_algs) - set(algorithms)
+        if len(invalid_algs) > 0:
+            raise ValueError(f"Algorithm(s) `{'`, `'.join(sorted(invalid_algs))}` not in the list of valid algorithms")
+        # use this list of algorithms
+        algorithms = parser_algs
+
+    # get the list of experiments to run on
+    if parser_exps is not None:
+        # check that experiments are valid (reporting all invalid ones at once)
+        invalid_exps = set(parser_exps) - set(experiments)
+        if len(invalid_exps) > 0:
+            raise ValueError(f"Experiment(s) `{'`, `'.join(sorted(invalid_exps))}` not in the list of valid experiments")
+        # use this list of experiments
+        experiments = parser_exps
+
+    # initialize MPI
+    import simplempi.simpleMPI as simpleMPI
+    smpi = simpleMPI.simpleMPI()
+
+    # an uncaught exception on any rank (e.g., a failed task) aborts the job
+    if smpi.mpisize > 1:
+        sys.excepthook = abort_on_exception
+
+    # only rank 0 searches the filesystem (every rank globbing the same
+    # directories multiplies the metadata load on the filesystem); the results
+    # are broadcast to the other ranks
+    if smpi.rank == 0:
+        # reuse the previous discovery if the searched directories are unchanged
+        discovery_manifest_path = \
+            get_discovery_manifest_path(algorithms, experiments)
+        discovery_key = get_discovery_key(algorithms, experiments)
+        input_paths = None
+        if not args.ignore_cache:
+            input_paths = load_discovery_manifest(
+                discovery_manifest_path, discovery_key)
+
+        if input_paths is None:
+            input_paths = discover_input_paths(algorithms, experiments)
+            save_discovery_manifest(
+                discovery_manifest_path, discovery_key, input_paths)
+    else:
+        input_paths = None
+    input_paths = broadcast_object(input_paths, root = 0)
+
+    # check that files were found for each algorithm and experiment (on all
+    # ranks, so that they all stop if any are missing)
+    for alg in algorithms:
+        for experiment in experiments:
+            nfiles = len(input_paths[alg][experiment]["files"])
+            if nfiles == 0:
+                raise ValueError(
+                    f"Algorithm `{alg}`, experiment `{experiment}` has no files.")
+            if len(input_paths[alg][experiment]["ivt_files"]) == 0:
+                raise ValueError(f"Experiment `{experiment}` has no IVT files.")
+
+            vprint(f"{alg}\t{experiment}\t{nfiles}")
+    vprint()
+
+    alg_exp_list = [ (exp, alg) for exp in experiments for alg in algorithms]
+
+    # rank 0 skips the tasks whose inputs, metadata, and code haven't changed
+    # since their outputs were written (according to the cache manifest)
+    if smpi.rank == 0:
+        manifest = {} if args.ignore_cache else load_cache_manifest()
+        code_version = get_code_version()
+
+        task_hashes = {}
+        task_list = []
+        for exp, alg in alg_exp_list:
+            key = f"{alg}/{exp}"
+            task_hashes[key] = get_task_hash(
+                exp, alg, input_paths[alg][exp], code_version)
+
+            entry = manifest.get(key)
+            if entry is not None and entry["hash"] == task_hashes[key] \
+                and entry.get("output_stats") \
+                    == get_output_stats(entry["output_files"]):
+                vprint(f"Skipping {alg}:{exp} (unchanged)")
+                entry["last_used"] = time.time()
+            else:
+                task_list.append((exp, alg))
+
+        # shuffle the tasks (reproducibly), so that the slow algorithms (which
+        # are at the end of each experiment's tasks) are spread out rather
+        # than all being handed out last
+        task_list = [ task_list[i] for i in \
+            np.random.default_rng(task_shuffle_seed).permutation(len(task_list)) ]
+
+        def record_task(exp, alg, output_files):
+            """ Add a completed task to the cache manifest. """
+            key = f"{alg}/{exp}"
+            manifest[key] = dict(
+                hash = task_hashes[key],
+                output_files = output_files,
+                output_stats = get_output_stats(output_files),
+                last_used = time.time())
+            save_cache_manifest(manifest)
+
+        def record_results(results):
+            """ Add the completed tasks to the cache manifest; raises if any
+            of the tasks failed. """
+            failures = []
+            for exp, alg, output_files, error in results:
+                if error is None:
+                    record_task(exp, alg, output_files)
+                else:
+                    failures.append(f"Task {alg}:{exp} failed:\n{error}")
+
+            if len(failures) > 0:
+                raise RuntimeError("\n".join(failures))
+
+    # loop over algorithms and experiments and run the standardizer; the run
+    # times vary a lot between algorithms, so rather than splitting the tasks up
+    # front, rank 0 hands them out one at a time to whichever rank is ready.
+    # Each rank runs up to `tasks_per_rank` tasks at once, so that one task's
+    # reading can overlap with another's computing or writing.
+    tasks_per_rank = args.tasks_per_rank
+    if tasks_per_rank < 1:
+        raise ValueError("--tasks_per_rank must be at least 1")
+    if smpi.mpisize == 1:
+        # there are no other ranks; run all of the tasks here
+        with get_task_executor(tasks_per_rank) as executor:
+            futures = { executor.submit(run_task, exp, alg,
+                                        input_paths[alg][exp]) : (exp, alg) \
+                for exp, alg in task_list }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    record_results([ get_task_result(future, futures[future]) ])
+            except BaseException:
+                # don't start the tasks that are still queued
+                executor.shutdown(cancel_futures = True)
+                raise
+        save_cache_manifest(manifest)
+
+    elif smpi.rank == 0:
+        from mpi4py import MPI
+
+        task_queue = collections.deque(task_list)
+        num_workers = smpi.mpisize - 1
+        status = MPI.Status()
+        while num_workers > 0:
+            # wait for any worker to report the results of its finished tasks
+            # and (unless it's done) ask for another task
+            results, wants_task = smpi.comm.recv(
+                source = MPI.ANY_SOURCE, status = status)
+            worker = status.Get_source()
+
+            # a failed task raises here, which aborts the job
+            record_results(results)
+
+            if not wants_task:
+                # the worker has finished all of its tasks
+                num_workers -= 1
+            elif len(task_queue) > 0:
+                # send the next task
+                smpi.comm.send(task_queue.popleft(), dest = worker)
+            else:
+                # there are no tasks left; tell the worker to stop asking
+                smpi.comm.send(None, dest = worker)
+
+        save_cache_manifest(manifest)
+
+    else:
+        results = []
+        running = {}
+        tasks_remaining = True
+        with get_task_executor(tasks_per_rank) as executor:
+            while tasks_remaining or len(running) > 0:
+                if tasks_remaining and len(running) < tasks_per_rank:
+                    # ask rank 0 for a task (sending the results so far)
+                    smpi.comm.send((results, True), dest = 0)
+                    results = []
+                    task = smpi.comm.recv(source = 0)
+
+                    # stop asking once the tasks have run out
+                    if task is None:
+                        tasks_remaining = False
+                    else:
+                        exp, alg = task
+                        future = executor.submit(
+                            run_task, exp, alg, input_paths[alg][exp])
+                        running[future] = (exp, alg)
+                    continue
+
+                # wait for a running task to finish; failed tasks are reported
+                # to rank 0 along with the successful ones
+                done, _ = concurrent.futures.wait(
+                    running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results.append(get_task_result(future, running.pop(future)))
+
+        # report the remaining results and that this rank is done
+        smpi.comm.send((results, False), dest = 0)
+
+    smpi.pprint("Done.")
+
+if __name__ == "__main__":
+    main()
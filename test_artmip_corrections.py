@@ -0,0 +1,83 @@
+""" Checks that corrections written to the original four-keyword contract (no
+`coord_cache` option, no single-pass mode) still register and run. """
+import numpy as np
+import xarray as xr
+import pytest
+import artmip_corrections
+from ARTMIPStandardizer import ARTMIPStandardizer
+
+
+def tag_legacy(
+    artmip_xr = None,
+    input_xr = None,
+    determine_only = False,
+    apply_only = False,
+    ):
+    """ Tag the dataset as corrected by a legacy correction. """
+
+    if determine_only:
+        return True
+
+    if apply_only:
+        output_xr = artmip_xr.copy()
+        output_xr.attrs["legacy_correction"] = "applied"
+        return output_xr
+
+
+@pytest.fixture
+def legacy_correction():
+    """ Registers `tag_legacy()` for the duration of a test. """
+    artmip_corrections.correction(tag_legacy)
+    yield tag_legacy
+    del artmip_corrections.all_corrections["tag_legacy"]
+    del artmip_corrections.all_correction_descriptions["tag_legacy"]
+
+
+def make_datasets():
+    """ Makes matching (in-memory) ARTMIP and input datasets. """
+    coords = dict(
+        time = ("time", np.arange(4, dtype = float),
+                dict(units = "days since 2000-01-01", calendar = "noleap")),
+        lat = ("lat", np.linspace(-60, 60, 3)),
+        lon = ("lon", np.arange(0, 360, 90.0)),
+        )
+    artmip_xr = xr.Dataset(
+        dict(ar_binary_tag = (("time", "lat", "lon"),
+                              np.ones((4, 3, 4), dtype = np.int8))),
+        coords = coords)
+    input_xr = xr.Dataset(
+        dict(IVT = (("time", "lat", "lon"), np.zeros((4, 3, 4)))),
+        coords = coords)
+    return artmip_xr, input_xr
+
+
+def test_determine_and_prepare_legacy(legacy_correction):
+    artmip_xr, input_xr = make_datasets()
+
+    needs_correction, apply_func = artmip_corrections.determine_and_prepare(
+        legacy_correction, artmip_xr, input_xr,
+        coord_cache = dict(
+            artmip = artmip_corrections.summarize_coordinates(artmip_xr),
+            input = artmip_corrections.summarize_coordinates(input_xr)))
+
+    assert needs_correction
+    assert apply_func(artmip_xr).attrs["legacy_correction"] == "applied"
+
+
+def test_apply_corrections_legacy(legacy_correction):
+    artmip_xr, input_xr = make_datasets()
+
+    standardizer = ARTMIPStandardizer(
+        artmip_xr, input_xr, "unused.{year}.nc",
+        auto_load_files = False,
+        auto_apply_corrections = False,
+        auto_write_files = False,
+        be_verbose = False)
+    standardizer.artmip_input_xr = artmip_xr
+    standardizer.original_input_xr = input_xr
+
+    standardizer.determine_corrections()
+    standardizer.apply_corrections()
+
+    assert "tag_legacy" in standardizer.corrections
+    assert standardizer.output_xr.attrs["legacy_correction"] == "applied"